@@ -1,27 +1,53 @@
 import dash
 from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
-import plotly.graph_objects as go
-import base64
-import io
+import hashlib
 import math
-from inference import run_inference
-from config import LOC_COLS
+from collections import namedtuple
+import os
+import flask
+import numpy as np
+import orjson
+import plotly.io as pio
+from flask.json.provider import JSONProvider
+from flask_caching import Cache
+from inference import CAM_METHOD, run_gradcam, run_predictions
+from utils import JET_LUT, decode_image, overlay_heatmap, summarize_probs
+from config import GRADCAM_THRESHOLD, LOC_COLS, IDX_TO_CLASS
+
+ClassMeta = namedtuple("ClassMeta", "color glow risk icon")
+RiskStyle = namedtuple("RiskStyle", "bg border color")
+
+_META_DEFAULT = ClassMeta("#64748b", "rgba(100,116,139,0.2)", "Unknown", "○")
+_DESC_DEFAULT = "Consult a dermatologist."
+_RISK_DEFAULT = RiskStyle("rgba(100,116,139,0.1)", "rgba(100,116,139,0.3)", "#64748b")
 
 def get_meta(class_name):
     """Case-insensitive lookup into CLASS_META."""
-    return CLASS_META.get(class_name.lower(), {"color": "#64748b", "glow": "rgba(100,116,139,0.2)", "risk": "Unknown", "icon": "○"})
+    meta = CLASS_META.get(class_name)
+    return meta if meta is not None else CLASS_META.get(class_name.lower(), _META_DEFAULT)
 
 def get_desc(class_name):
-    return CLASS_DESC.get(class_name.lower(), "Consult a dermatologist.")
+    desc = CLASS_DESC.get(class_name)
+    return desc if desc is not None else CLASS_DESC.get(class_name.lower(), _DESC_DEFAULT)
 
 def get_risk_style(risk):
-    return RISK_STYLE.get(risk, {"bg": "rgba(100,116,139,0.1)", "border": "rgba(100,116,139,0.3)", "color": "#64748b"})
+    return RISK_STYLE.get(risk, _RISK_DEFAULT)
 # ─────────────────────────────────────────────────────────────
 #  App init
 # ─────────────────────────────────────────────────────────────
+# With Redis available, the analysis callback runs on Celery workers
+# (`celery -A app:celery_app worker`) so web workers are never blocked.
+celery_app = None
+background_callback_manager = None
+if os.environ.get("REDIS_URL"):
+    from celery import Celery
+    celery_app = Celery(__name__, broker=os.environ["REDIS_URL"], backend=os.environ["REDIS_URL"])
+    background_callback_manager = dash.CeleryManager(celery_app)
+
 app = dash.Dash(
     __name__,
+    background_callback_manager=background_callback_manager,
     external_stylesheets=[
         dbc.themes.CYBORG,
         "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&family=JetBrains+Mono:wght@400;500&display=swap",
@@ -29,25 +55,114 @@ app = dash.Dash(
     meta_tags=[
         {"name": "viewport", "content": "width=device-width, initial-scale=1, shrink-to-fit=no"},
     ],
+    compress=True,
+    update_title=None,
+    # The CAM image is created by the analysis callback, not the layout.
+    suppress_callback_exceptions=True,
 )
 server = app.server
+if __name__ != "__main__":
+    # Served by gunicorn: make sure no dev-tools polling or UI is enabled.
+    app.enable_dev_tools(debug=False, dev_tools_ui=False, dev_tools_hot_reload=False)
+
+
+class _OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (C encoder with native numpy support)."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+server.json = _OrjsonProvider(server)
+# Dash serializes layout and callback responses (figures included) through
+# plotly.io.json; use its orjson engine rather than json + PlotlyJSONEncoder.
+pio.json.config.default_engine = "orjson"
+
+# Inference results are memoized per (image, metadata). Use Redis when a
+# REDIS_URL is configured so the cache is shared across workers.
+cache = Cache(server, config={
+    "CACHE_TYPE":            "RedisCache" if os.environ.get("REDIS_URL") else "SimpleCache",
+    "CACHE_REDIS_URL":       os.environ.get("REDIS_URL"),
+    "CACHE_DEFAULT_TIMEOUT": 86400,
+    "CACHE_THRESHOLD":       64,
+})
+
+UPLOAD_TIMEOUT = 3600
+
+# Matches the "max 10 MB" hint in the drop zone. Flask rejects larger request
+# bodies with a 413 before they are read, which also bounds how much memory
+# each cached upload can hold.
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+server.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 64 * 1024  # multipart overhead
+
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+)
+
+
+def _sniff_image_type(raw):
+    """Returns "image/jpeg" / "image/png" from the file's magic bytes, else None."""
+    for magic, mimetype in _IMAGE_SIGNATURES:
+        if raw.startswith(magic):
+            return mimetype
+    return None
+
+
+@server.route("/upload", methods=["POST"])
+def upload_image():
+    """Accepts the raw image as multipart form data and returns its content id.
+
+    The id is the SHA-256 of the file, so re-uploading the same image reuses
+    both the stored upload and any cached inference results.
+    """
+    f = flask.request.files.get("image")
+    if f is None:
+        flask.abort(400)
+    raw = f.read(MAX_UPLOAD_BYTES + 1)
+    # The client-supplied mimetype is ignored: only real JPEG/PNG bytes are
+    # accepted, and they are served back under the type sniffed here.
+    mimetype = _sniff_image_type(raw)
+    if mimetype is None or len(raw) > MAX_UPLOAD_BYTES:
+        flask.abort(400)
+    upload_id = hashlib.sha256(raw).hexdigest()
+    cache.set(f"upload:{upload_id}", (mimetype, raw), timeout=UPLOAD_TIMEOUT)
+    return {"id": upload_id}
+
+
+@server.route("/upload/<upload_id>")
+def serve_upload(upload_id):
+    upload = cache.get(f"upload:{upload_id}")
+    if upload is None:
+        flask.abort(404)
+    mimetype, raw = upload
+    response = flask.Response(raw, mimetype=mimetype)
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
 app.title = "DermAI — Diagnostic Intelligence"
+# UI styles live in assets/custom2.css and are served (and cached) by Dash's
+# asset loader. Assets load alphabetically, so it still overrides custom1.css.
 
 # ─────────────────────────────────────────────────────────────
 #  Data constants
 # ─────────────────────────────────────────────────────────────
-loc_options = [
-    loc.replace("localization_", "").replace("_", " ").title() for loc in LOC_COLS
-]
+LOC_OPTION_DICTS = tuple(
+    {"label": (label := loc.removeprefix("localization_").replace("_", " ").title()),
+     "value": label.lower()}
+    for loc in LOC_COLS
+)
 
 CLASS_META = {
-    "melanoma":             {"color": "#ff4d6d", "glow": "rgba(255,77,109,0.35)", "risk": "High",          "icon": "⬟"},
-    "melanocytic nevi":     {"color": "#00d9a3", "glow": "rgba(0,217,163,0.3)",   "risk": "Low",           "icon": "◉"},
-    "basal cell carcinoma": {"color": "#ff8c42", "glow": "rgba(255,140,66,0.32)", "risk": "Moderate-High", "icon": "◈"},
-    "actinic keratoses":    {"color": "#ffd166", "glow": "rgba(255,209,102,0.3)", "risk": "Moderate",      "icon": "◇"},
-    "benign keratosis":     {"color": "#DADAD6", "glow": "rgba(56,189,248,0.28)", "risk": "Low",           "icon": "○"},
-    "dermatofibroma":       {"color": "#4cc9f0", "glow": "rgba(76,201,240,0.3)",  "risk": "Low",           "icon": "◎"},
-    "vascular lesions":     {"color": "#b185db", "glow": "rgba(177,133,219,0.3)", "risk": "Low-Moderate",  "icon": "◐"},
+    "melanoma":             ClassMeta("#ff4d6d", "rgba(255,77,109,0.35)", "High",          "⬟"),
+    "melanocytic nevi":     ClassMeta("#00d9a3", "rgba(0,217,163,0.3)",   "Low",           "◉"),
+    "basal cell carcinoma": ClassMeta("#ff8c42", "rgba(255,140,66,0.32)", "Moderate-High", "◈"),
+    "actinic keratoses":    ClassMeta("#ffd166", "rgba(255,209,102,0.3)", "Moderate",      "◇"),
+    "benign keratosis":     ClassMeta("#DADAD6", "rgba(56,189,248,0.28)", "Low",           "○"),
+    "dermatofibroma":       ClassMeta("#4cc9f0", "rgba(76,201,240,0.3)",  "Low",           "◎"),
+    "vascular lesions":     ClassMeta("#b185db", "rgba(177,133,219,0.3)", "Low-Moderate",  "◐"),
 }
 
 CLASS_DESC = {
@@ -60,633 +175,34 @@ CLASS_DESC = {
     "vascular lesions":     "Includes haemangiomas and angiomas. Usually benign.",
 }
 
-RISK_STYLE = {
-    "High":          {"bg": "rgba(255,77,109,0.15)",  "border": "rgba(255,77,109,0.5)",  "color": "#ff4d6d"},
-    "Moderate-High": {"bg": "rgba(255,140,66,0.15)",  "border": "rgba(255,140,66,0.5)",  "color": "#ff8c42"},
-    "Moderate":      {"bg": "rgba(255,209,102,0.15)", "border": "rgba(255,209,102,0.5)", "color": "#ffd166"},
-    "Low-Moderate":  {"bg": "rgba(76,201,240,0.12)",  "border": "rgba(76,201,240,0.4)",  "color": "#4cc9f0"},
-    "Low":           {"bg": "rgba(0,217,163,0.12)",   "border": "rgba(0,217,163,0.4)",   "color": "#00d9a3"},
-}
-
-
-# ─────────────────────────────────────────────────────────────
-#  CSS (loaded via assets/custom.css OR app.index_string)
-# ─────────────────────────────────────────────────────────────
-CUSTOM_CSS = """
-/* ═══════════════════════════════════════════════════════
-   DERM AI — FUTURISTIC DARK UI
-═══════════════════════════════════════════════════════ */
-:root {
-  --bg:         #050a14;
-  --bg-1:       #080e1c;
-  --bg-2:       #0c1526;
-  --bg-3:       #111e35;
-  --border:     rgba(255,255,255,0.07);
-  --border-hi:  rgba(76,201,240,0.25);
-  --cyan:       #4cc9f0;
-  --violet:     #7c3aed;
-  --pink:       #ff4d6d;
-  --green:      #00d9a3;
-  --amber:      #ffd166;
-  --text:       #e2eaf8;
-  --muted:      #4a6080;
-  --font:       'Inter', sans-serif;
-  --mono:       'JetBrains Mono', monospace;
-}
-
-*, *::before, *::after { box-sizing: border-box; margin: 0; padding: 0; }
-
-html { scroll-behavior: smooth; }
-
-body {
-  background: var(--bg) !important;
-  background-image:
-    radial-gradient(ellipse 80% 50% at 50% -20%, rgba(76,201,240,0.06) 0%, transparent 60%),
-    radial-gradient(ellipse 60% 40% at 80% 80%, rgba(124,58,237,0.05) 0%, transparent 50%) !important;
-  color: var(--text) !important;
-  font-family: var(--font) !important;
-  font-size: 14px;
-  line-height: 1.55;
-  min-height: 100vh;
-  overflow-x: hidden;
-}
-
-/* ── Scrollbar ─────────────────────────────────── */
-::-webkit-scrollbar { width: 4px; }
-::-webkit-scrollbar-track { background: var(--bg-1); }
-::-webkit-scrollbar-thumb { background: var(--border-hi); border-radius: 2px; }
-
-/* ══════════════════════════════════════════════════
-   HEADER
-══════════════════════════════════════════════════ */
-.ai-header {
-  position: sticky; top: 0; z-index: 1000;
-  display: flex; align-items: center; justify-content: space-between;
-  padding: 0 32px;
-  height: 62px;
-  background: rgba(5,10,20,0.85);
-  backdrop-filter: blur(20px) saturate(180%);
-  border-bottom: 1px solid var(--border);
-  gap: 16px;
-}
-
-.ai-header::after {
-  content: '';
-  position: absolute;
-  bottom: 0; left: 0; right: 0;
-  height: 1px;
-  background: linear-gradient(90deg, transparent, var(--cyan), var(--violet), transparent);
-  opacity: 0.5;
-}
-
-.hdr-brand {
-  display: flex; align-items: center; gap: 14px;
-}
-
-.hdr-logo-wrap {
-  position: relative; width: 40px; height: 40px;
-}
-
-.hdr-logo {
-  width: 40px; height: 40px;
-  background: linear-gradient(135deg, rgba(76,201,240,0.2), rgba(124,58,237,0.3));
-  border: 1px solid rgba(76,201,240,0.3);
-  border-radius: 10px;
-  display: flex; align-items: center; justify-content: center;
-  font-size: 19px;
-  box-shadow: 0 0 24px rgba(76,201,240,0.2), inset 0 1px 0 rgba(255,255,255,0.08);
-}
-
-.hdr-text-block { display: flex; flex-direction: column; }
-.hdr-title { font-size: 1.05rem; font-weight: 800; letter-spacing: -0.3px; color: var(--text); }
-.hdr-sub   { font-size: 0.63rem; color: var(--muted); letter-spacing: 1.2px; text-transform: uppercase; margin-top: 1px; }
-
-.hdr-right { display: flex; align-items: center; gap: 10px; }
-
-.status-dot {
-  display: flex; align-items: center; gap: 6px;
-  background: rgba(0,217,163,0.08);
-  border: 1px solid rgba(0,217,163,0.25);
-  border-radius: 99px; padding: 4px 12px;
-  font-size: 0.65rem; font-weight: 600; color: var(--green);
-  letter-spacing: 0.5px; text-transform: uppercase;
-}
-
-.status-dot::before {
-  content: '';
-  width: 6px; height: 6px;
-  background: var(--green);
-  border-radius: 50%;
-  box-shadow: 0 0 8px var(--green);
-  animation: pulse-dot 2s ease-in-out infinite;
-}
-
-@keyframes pulse-dot {
-  0%, 100% { opacity: 1; }
-  50% { opacity: 0.35; }
-}
-
-.model-tag {
-  background: rgba(76,201,240,0.07);
-  border: 1px solid rgba(76,201,240,0.2);
-  border-radius: 99px; padding: 4px 12px;
-  font-size: 0.63rem; font-weight: 500; color: var(--cyan);
-  letter-spacing: 0.4px; text-transform: uppercase;
-  font-family: var(--mono);
-}
-
-/* ══════════════════════════════════════════════════
-   PAGE WRAP
-══════════════════════════════════════════════════ */
-.page-wrap {
-  max-width: 1420px;
-  margin: 0 auto;
-  padding: 28px 20px 48px;
-}
-
-/* ══════════════════════════════════════════════════
-   GLASS PANELS
-══════════════════════════════════════════════════ */
-.glass-panel {
-  background: rgba(8,14,28,0.7);
-  border: 1px solid var(--border);
-  border-radius: 16px;
-  backdrop-filter: blur(12px);
-  overflow: hidden;
-  position: relative;
-  transition: border-color 0.3s;
-}
-
-.glass-panel::before {
-  content: '';
-  position: absolute;
-  inset: 0; border-radius: 16px;
-  background: linear-gradient(135deg, rgba(255,255,255,0.03) 0%, transparent 60%);
-  pointer-events: none;
-}
-
-.panel-hdr {
-  display: flex; align-items: center; gap: 10px;
-  padding: 14px 20px;
-  border-bottom: 1px solid var(--border);
-  background: rgba(255,255,255,0.02);
-}
-
-.panel-hdr-icon {
-  width: 28px; height: 28px;
-  background: rgba(76,201,240,0.1);
-  border: 1px solid rgba(76,201,240,0.22);
-  border-radius: 7px;
-  display: flex; align-items: center; justify-content: center;
-  font-size: 13px; flex-shrink: 0;
-  box-shadow: 0 0 12px rgba(76,201,240,0.12);
-}
-
-.panel-hdr-title {
-  font-size: 0.7rem; font-weight: 700;
-  text-transform: uppercase; letter-spacing: 1.2px;
-  color: var(--muted);
-}
-
-.panel-body { padding: 20px; }
-
-/* ══════════════════════════════════════════════════
-   FORM ELEMENTS
-══════════════════════════════════════════════════ */
-.field-label {
-  display: block;
-  font-size: 0.63rem; font-weight: 600;
-  text-transform: uppercase; letter-spacing: 1px;
-  color: var(--muted);
-  margin-bottom: 6px;
-}
-
-input[type="number"] {
-  width: 100% !important;
-  background: rgba(255,255,255,0.04) !important;
-  border: 1px solid var(--border) !important;
-  color: var(--text) !important;
-  border-radius: 9px !important;
-  padding: 9px 13px !important;
-  font-size: 0.85rem !important;
-  font-family: var(--mono) !important;
-  transition: border-color 0.2s, box-shadow 0.2s !important;
-  margin-bottom: 16px;
-  outline: none !important;
-}
-
-input[type="number"]:focus {
-  border-color: rgba(76,201,240,0.5) !important;
-  box-shadow: 0 0 0 3px rgba(76,201,240,0.08), 0 0 16px rgba(76,201,240,0.08) !important;
-}
-
-/* ── Dropdown (react-select via Dash) ── */
-/* ── Dropdown (react-select via Dash) ── */
-.Select-control {
-  background: rgba(12, 21, 38, 0.95) !important;
-  border: 1px solid var(--border) !important;
-  border-radius: 9px !important;
-  min-height: 40px !important;
-  cursor: pointer !important;
-  transition: border-color 0.2s !important;
-}
-.Select-control:hover { border-color: rgba(76,201,240,0.3) !important; }
-
-.Select-menu-outer {
-  background: #0c1526 !important;
-  border: 1px solid rgba(76,201,240,0.2) !important;
-  border-radius: 10px !important;
-  box-shadow: 0 16px 48px rgba(0,0,0,0.8) !important;
-  z-index: 9999 !important;
-  overflow: hidden !important;
-}
-
-.Select-menu { background: #0c1526 !important; }
+# Alias the model's display names (e.g. "Melanocytic nevi") so the lookups on
+# the callback path hit directly instead of lowercasing every class name.
+for _name in IDX_TO_CLASS.values():
+    if _name.lower() in CLASS_META:
+        CLASS_META.setdefault(_name, CLASS_META[_name.lower()])
+        CLASS_DESC.setdefault(_name, CLASS_DESC[_name.lower()])
 
-.Select-option {
-  background: #0c1526 !important;
-  color: #8aa0be !important;
-  font-size: 0.83rem !important;
-  padding: 9px 14px !important;
-  transition: background 0.15s, color 0.15s !important;
-}
-
-.Select-option.is-focused, .Select-option:hover {
-  background: rgba(76,201,240,0.1) !important;
-  color: var(--cyan) !important;
-}
-
-.Select-option.is-selected {
-  background: rgba(76,201,240,0.15) !important;
-  color: var(--text) !important;
-}
-
-.Select-value          { background: transparent !important; }
-.Select-value-label    { color: var(--text) !important; font-size: 0.85rem !important; }
-.Select-placeholder    { color: var(--muted) !important; font-size: 0.85rem !important; }
-.Select-arrow          { border-top-color: var(--muted) !important; }
-.Select-input          { background: transparent !important; }
-.Select-input input    { color: var(--text) !important; font-family: var(--font) !important; background: transparent !important; }
-.VirtualizedSelectFocusedOption { background: rgba(76,201,240,0.1) !important; color: var(--cyan) !important; }
-.VirtualizedSelectOption { background: #0c1526 !important; color: #8aa0be !important; }
-
-
-/* ── Native select (dbc.Select) ── */
-select {
-  background: #0c1526 !important;
-  border: 1px solid rgba(255,255,255,0.07) !important;
-  color: #e2eaf8 !important;
-  border-radius: 9px !important;
-  padding: 9px 13px !important;
-  font-size: 0.85rem !important;
-  font-family: 'JetBrains Mono', monospace !important;
-  width: 100% !important;
-  cursor: pointer !important;
-  transition: border-color 0.2s, box-shadow 0.2s !important;
-  outline: none !important;
-  -webkit-appearance: auto !important;
-}
-
-select:focus {
-  border-color: rgba(76,201,240,0.5) !important;
-  box-shadow: 0 0 0 3px rgba(76,201,240,0.08) !important;
-}
-
-select option {
-  background: #0c1526 !important;
-  color: #e2eaf8 !important;
-}
-/* ── Upload drop zone ── */
-.drop-zone {
-  border: 2px dashed rgba(76,201,240,0.2) !important;
-  border-radius: 12px !important;
-  background: rgba(76,201,240,0.03) !important;
-  padding: 28px 16px !important;
-  text-align: center !important;
-  cursor: pointer !important;
-  transition: all 0.25s !important;
-  position: relative;
-  overflow: hidden;
-}
-
-.drop-zone::before {
-  content: '';
-  position: absolute; inset: 0;
-  background: radial-gradient(ellipse at center, rgba(76,201,240,0.05), transparent 70%);
-  opacity: 0; transition: opacity 0.25s;
-  pointer-events: none;
-}
-
-.drop-zone:hover {
-  border-color: rgba(76,201,240,0.5) !important;
-  background: rgba(76,201,240,0.06) !important;
-  box-shadow: 0 0 24px rgba(76,201,240,0.06) !important;
-}
-.drop-zone:hover::before { opacity: 1; }
-
-.dz-icon   { font-size: 28px; color: var(--cyan); margin-bottom: 8px; opacity: 0.7; }
-.dz-title  { font-size: 0.82rem; color: var(--muted); }
-.dz-link   { color: var(--cyan); font-weight: 600; }
-.dz-hint   { font-size: 0.63rem; color: var(--muted); margin-top: 4px; opacity: 0.6; }
-
-/* ── Run button ── */
-.run-btn {
-  width: 100%;
-  position: relative;
-  background: linear-gradient(135deg, rgba(76,201,240,0.15), rgba(124,58,237,0.2)) !important;
-  border: 1px solid rgba(76,201,240,0.3) !important;
-  border-radius: 10px !important;
-  padding: 12px !important;
-  font-size: 0.83rem !important;
-  font-weight: 700 !important;
-  letter-spacing: 1px !important;
-  text-transform: uppercase !important;
-  color: var(--cyan) !important;
-  cursor: pointer !important;
-  overflow: hidden;
-  transition: all 0.25s !important;
-  box-shadow: 0 0 20px rgba(76,201,240,0.08), inset 0 1px 0 rgba(255,255,255,0.06) !important;
-  margin-top: 8px;
-}
-
-.run-btn::before {
-  content: '';
-  position: absolute; top: 0; left: -100%;
-  width: 100%; height: 100%;
-  background: linear-gradient(90deg, transparent, rgba(76,201,240,0.12), transparent);
-  transition: left 0.5s;
-}
-
-.run-btn:hover {
-  border-color: rgba(76,201,240,0.6) !important;
-  box-shadow: 0 0 32px rgba(76,201,240,0.18), inset 0 1px 0 rgba(255,255,255,0.1) !important;
-  color: #fff !important;
-}
-.run-btn:hover::before { left: 100%; }
-
-/* ── Spec chips ── */
-.spec-row  { display: grid; grid-template-columns: repeat(3,1fr); gap: 8px; margin-top: 8px; }
-.spec-chip {
-  background: rgba(255,255,255,0.03);
-  border: 1px solid var(--border);
-  border-radius: 10px; padding: 10px 8px; text-align: center;
-  transition: border-color 0.2s;
-}
-.spec-chip:hover { border-color: var(--border-hi); }
-.spec-val { font-size: 0.95rem; font-weight: 800; color: var(--text); line-height: 1.1; font-family: var(--mono); }
-.spec-lbl { font-size: 0.58rem; color: var(--muted); text-transform: uppercase; letter-spacing: 0.8px; margin-top: 3px; }
-
-/* ══════════════════════════════════════════════════
-   RESULTS — PREDICTION BANNER
-══════════════════════════════════════════════════ */
-.pred-card {
-  border-radius: 14px;
-  padding: 20px 22px;
-  display: flex; align-items: center;
-  justify-content: space-between;
-  flex-wrap: wrap; gap: 14px;
-  margin-bottom: 20px;
-  position: relative; overflow: hidden;
-}
-
-.pred-card::after {
-  content: '';
-  position: absolute; top: 0; right: 0;
-  width: 160px; height: 160px;
-  border-radius: 50%;
-  filter: blur(50px);
-  opacity: 0.25;
-  pointer-events: none;
-}
-
-.pred-eyebrow {
-  font-size: 0.62rem; font-weight: 700;
-  text-transform: uppercase; letter-spacing: 1.2px;
-  opacity: 0.6; margin-bottom: 4px;
-}
-.pred-name  { font-size: 1.4rem; font-weight: 800; letter-spacing: -0.5px; line-height: 1.15; }
-.pred-desc  { font-size: 0.76rem; opacity: 0.65; margin-top: 5px; max-width: 400px; line-height: 1.5; }
-
-.risk-tag {
-  display: inline-flex; align-items: center; gap: 5px;
-  border-radius: 6px; padding: 3px 10px;
-  font-size: 0.65rem; font-weight: 700;
-  letter-spacing: 0.5px; text-transform: uppercase;
-  margin-top: 8px;
-}
-
-.conf-ring {
-  display: flex; flex-direction: column; align-items: center; gap: 2px;
-  flex-shrink: 0;
-}
-.conf-num { font-size: 2.2rem; font-weight: 800; line-height: 1; font-family: var(--mono); }
-.conf-lbl { font-size: 0.58rem; color: var(--muted); text-transform: uppercase; letter-spacing: 1px; }
-
-/* ══════════════════════════════════════════════════
-   UNCERTAINTY NOTICE
-══════════════════════════════════════════════════ */
-.unc-bar {
-  background: rgba(255,209,102,0.06);
-  border: 1px solid rgba(255,209,102,0.25);
-  border-left: 3px solid var(--amber);
-  border-radius: 0 9px 9px 0;
-  padding: 10px 14px;
-  font-size: 0.75rem;
-  color: var(--amber);
-  display: flex; align-items: flex-start; gap: 9px;
-  margin-bottom: 16px; line-height: 1.45;
-}
-
-.unc-icon { font-size: 14px; flex-shrink: 0; margin-top: 1px; }
-
-/* ══════════════════════════════════════════════════
-   IMAGE PANELS
-══════════════════════════════════════════════════ */
-.img-card {
-  border-radius: 12px; overflow: hidden;
-  border: 1px solid var(--border);
-  background: var(--bg-2);
-  transition: border-color 0.25s;
-}
-.img-card:hover { border-color: var(--border-hi); }
-
-.img-card-hdr {
-  display: flex; align-items: center; justify-content: space-between;
-  padding: 9px 14px;
-  background: rgba(255,255,255,0.025);
-  border-bottom: 1px solid var(--border);
-}
-
-.img-card-lbl {
-  font-size: 0.63rem; font-weight: 700;
-  text-transform: uppercase; letter-spacing: 1px;
-  color: var(--muted);
-}
-
-.img-card-badge {
-  font-size: 0.58rem; font-weight: 600;
-  padding: 2px 7px; border-radius: 4px;
-  background: rgba(76,201,240,0.1);
-  border: 1px solid rgba(76,201,240,0.25);
-  color: var(--cyan); letter-spacing: 0.4px;
-}
-
-.img-card img {
-  width: 100%;
-  height: auto;
-  max-height: 340px;
-  object-fit: contain;
-  display: block;
-  background: #080e1c;
-  padding: 8px;
-}
-
-.cam-badge {
-  background: rgba(255,77,109,0.12) !important;
-  border-color: rgba(255,77,109,0.3) !important;
-  color: #ff4d6d !important;
-}
-
-/* ══════════════════════════════════════════════════
-   SECTION / BOX
-══════════════════════════════════════════════════ */
-.sec-lbl {
-  font-size: 0.62rem; font-weight: 700;
-  text-transform: uppercase; letter-spacing: 1.1px;
-  color: var(--muted); margin-bottom: 10px;
-}
-
-.data-box {
-  background: rgba(255,255,255,0.025);
-  border: 1px solid var(--border);
-  border-radius: 12px;
-  padding: 14px 16px;
-  height: 100%;
-  transition: border-color 0.25s;
-}
-.data-box:hover { border-color: var(--border-hi); }
-
-/* ── Horizontal divider ── */
-.hdiv {
-  border: 0;
-  border-top: 1px solid var(--border);
-  margin: 14px 0;
-}
+RISK_STYLE = {
+    "High":          RiskStyle("rgba(255,77,109,0.15)",  "rgba(255,77,109,0.5)",  "#ff4d6d"),
+    "Moderate-High": RiskStyle("rgba(255,140,66,0.15)",  "rgba(255,140,66,0.5)",  "#ff8c42"),
+    "Moderate":      RiskStyle("rgba(255,209,102,0.15)", "rgba(255,209,102,0.5)", "#ffd166"),
+    "Low-Moderate":  RiskStyle("rgba(76,201,240,0.12)",  "rgba(76,201,240,0.4)",  "#4cc9f0"),
+    "Low":           RiskStyle("rgba(0,217,163,0.12)",   "rgba(0,217,163,0.4)",   "#00d9a3"),
+}
+
+# Static parts of the result figures' layouts; only the traces change per run.
+DONUT_LAYOUT = dict(
+    paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+    margin=dict(l=10, r=10, t=10, b=10), height=220,
+    showlegend=False, font=dict(family="Inter"),
+)
 
-/* ══════════════════════════════════════════════════
-   PROBABILITY LIST
-══════════════════════════════════════════════════ */
-.prob-item {
-  display: flex; align-items: center; gap: 10px;
-  padding: 7px 0;
-  border-bottom: 1px solid rgba(255,255,255,0.04);
-}
-.prob-item:last-child { border-bottom: none; }
-
-.prob-dot   { width: 7px; height: 7px; border-radius: 50%; flex-shrink: 0; }
-.prob-label { font-size: 0.76rem; color: var(--text); flex: 1; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
-.prob-track { flex: 2; height: 3px; background: rgba(255,255,255,0.06); border-radius: 99px; overflow: hidden; }
-.prob-fill  { height: 100%; border-radius: 99px; transition: width 0.7s cubic-bezier(0.4,0,0.2,1); }
-.prob-pct   { font-size: 0.68rem; font-weight: 600; color: var(--muted); width: 38px; text-align: right; font-family: var(--mono); }
-
-/* ══════════════════════════════════════════════════
-   ENTROPY / PATIENT SUMMARY
-══════════════════════════════════════════════════ */
-.ent-row { display: flex; align-items: center; justify-content: space-between; margin-bottom: 6px; }
-.ent-label { font-size: 0.72rem; color: var(--muted); }
-.ent-val   { font-size: 0.78rem; font-weight: 700; font-family: var(--mono); }
-
-.ent-bar-wrap { background: rgba(255,255,255,0.06); border-radius: 99px; height: 4px; overflow: hidden; margin-bottom: 10px; }
-.ent-bar-fill { height: 100%; border-radius: 99px; transition: width 0.7s ease; }
-
-.patient-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 8px; }
-.pt-chip {
-  background: rgba(255,255,255,0.03);
-  border: 1px solid var(--border);
-  border-radius: 9px;
-  padding: 9px 10px; text-align: center;
-}
-.pt-chip.full { grid-column: span 2; }
-.pt-val { font-size: 0.95rem; font-weight: 700; color: var(--text); font-family: var(--mono); }
-.pt-lbl { font-size: 0.58rem; color: var(--muted); text-transform: uppercase; letter-spacing: 0.7px; margin-top: 2px; }
-
-/* ══════════════════════════════════════════════════
-   PLACEHOLDER
-══════════════════════════════════════════════════ */
-.empty-state {
-  display: flex; flex-direction: column;
-  align-items: center; justify-content: center;
-  min-height: 380px; gap: 14px; color: var(--muted);
-}
-.empty-icon { font-size: 42px; opacity: 0.12; }
-.empty-title { font-size: 0.88rem; font-weight: 600; opacity: 0.35; }
-.empty-sub   { font-size: 0.73rem; opacity: 0.25; text-align: center; max-width: 220px; line-height: 1.5; }
-
-/* ══════════════════════════════════════════════════
-   DISCLAIMER
-══════════════════════════════════════════════════ */
-.disclaimer {
-  background: rgba(255,77,109,0.04);
-  border: 1px solid rgba(255,77,109,0.15);
-  border-left: 3px solid rgba(255,77,109,0.6);
-  border-radius: 0 10px 10px 0;
-  padding: 14px 18px;
-  margin-top: 28px;
-}
-.dis-hdr { display: flex; align-items: center; gap: 8px; margin-bottom: 6px; }
-.dis-title { font-size: 0.65rem; font-weight: 700; color: rgba(255,77,109,0.8); text-transform: uppercase; letter-spacing: 1px; }
-.dis-body  { font-size: 0.74rem; color: var(--muted); line-height: 1.6; }
-
-/* ══════════════════════════════════════════════════
-   PLOTLY OVERRIDES
-══════════════════════════════════════════════════ */
-.js-plotly-plot .plotly .bg { fill: transparent !important; }
-.js-plotly-plot { background: transparent !important; }
-.modebar { display: none !important; }
-
-/* ══════════════════════════════════════════════════
-   DASH LOADING
-══════════════════════════════════════════════════ */
-._dash-loading { background: transparent !important; }
-.dash-spinner circle { stroke: var(--cyan) !important; }
-
-/* ══════════════════════════════════════════════════
-   RESPONSIVE
-══════════════════════════════════════════════════ */
-@media (max-width: 767px) {
-  .ai-header { padding: 0 16px; }
-  .hdr-right { display: none; }
-  .page-wrap { padding: 16px 12px 36px; }
-  .pred-card { flex-direction: column; }
-  .img-card img { height: 170px; }
-}
-@media (max-width: 480px) {
-  .pred-name { font-size: 1.1rem; }
-  .conf-num  { font-size: 1.7rem; }
-  .spec-row  { gap: 5px; }
-}
-"""
-
-# Inject CSS via index_string
-app.index_string = f"""<!DOCTYPE html>
-<html>
-  <head>
-    {{%metas%}}
-    <title>{{%title%}}</title>
-    {{%favicon%}}
-    {{%css%}}
-    <style>{CUSTOM_CSS}</style>
-  </head>
-  <body>
-    {{%app_entry%}}
-    <footer>
-      {{%config%}}
-      {{%scripts%}}
-      {{%renderer%}}
-    </footer>
-  </body>
-</html>
-"""
+GAUGE_LAYOUT = dict(
+    paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+    margin=dict(l=10, r=10, t=36, b=6),
+    height=200,
+    font=dict(family="Inter"),
+)
 
 
 # ─────────────────────────────────────────────────────────────
@@ -720,7 +236,7 @@ app.layout = html.Div(
             ]),
             html.Div(className="hdr-right", children=[
                 html.Div("Model Online", className="status-dot"),
-                html.Div("EfficientNet · TTA · GradCAM XAI", className="model-tag"),
+                html.Div(f"EfficientNet · TTA · {CAM_METHOD} XAI", className="model-tag"),
             ]),
         ]),
 
@@ -738,50 +254,20 @@ app.layout = html.Div(
                         html.Div(className="panel-body", children=[
 
                             html.Label("Patient Age", className="field-label"),
-                            dbc.Input(id="input-age", type="number", value=45, min=0, max=120,
-                                      style={"background": "rgba(255,255,255,0.04)",
-                                             "border": "1px solid rgba(255,255,255,0.07)",
-                                             "color": "#e2eaf8", "borderRadius": "9px",
-                                             "marginBottom": "16px", "fontFamily": "JetBrains Mono, monospace"}),
+                            dbc.Input(id="input-age", type="number", value=45, min=0, max=120),
                             html.Label("Biological Sex", className="field-label"),
                             dbc.Select(
                                 id="input-sex",
                                 options=[{"label": "Male", "value": "male"},
                                         {"label": "Female", "value": "female"}],
                                 value="male",
-                                style={
-                                    "background": "#0c1526",
-                                    "border": "1px solid rgba(255,255,255,0.07)",
-                                    "color": "#e2eaf8",
-                                    "borderRadius": "9px",
-                                    "padding": "9px 13px",
-                                    "fontSize": "0.85rem",
-                                    "fontFamily": "JetBrains Mono, monospace",
-                                    "marginBottom": "16px",
-                                    "cursor": "pointer",
-                                    "appearance": "auto",
-                                    "width": "100%",
-                                },
                             ),
 
                             html.Label("Lesion Location", className="field-label"),
                             dbc.Select(
                                 id="input-loc",
-                                options=[{"label": l, "value": l.lower()} for l in loc_options],
+                                options=LOC_OPTION_DICTS,
                                 value="back",
-                                style={
-                                    "background": "#0c1526",
-                                    "border": "1px solid rgba(255,255,255,0.07)",
-                                    "color": "#e2eaf8",
-                                    "borderRadius": "9px",
-                                    "padding": "9px 13px",
-                                    "fontSize": "0.85rem",
-                                    "fontFamily": "JetBrains Mono, monospace",
-                                    "marginBottom": "16px",
-                                    "cursor": "pointer",
-                                    "appearance": "auto",
-                                    "width": "100%",
-                                },
                             ),
 
                             html.Label("Dermoscopic Image", className="field-label"),
@@ -793,12 +279,13 @@ app.layout = html.Div(
                                     html.P("PNG · JPG · JPEG — max 10 MB", className="dz-hint"),
                                 ]),
                                 multiple=False,
+                                accept="image/png,image/jpeg",
+                                max_size=MAX_UPLOAD_BYTES,
                                 style={"marginBottom": "6px"},
                             ),
-                            html.Div(id="upload-status",
-                                     style={"fontSize": "0.7rem", "color": "#00d9a3",
-                                            "minHeight": "18px", "marginBottom": "10px",
-                                            "fontFamily": "JetBrains Mono, monospace"}),
+                            dcc.Store(id="upload-id"),
+                            dcc.Store(id="gradcam-request"),
+                            html.Div(id="upload-status", className="upload-status"),
 
                             html.Button("⟶  Run Analysis", id="submit-button",
                                         className="run-btn", n_clicks=0),
@@ -835,6 +322,8 @@ app.layout = html.Div(
                             dcc.Loading(
                                 type="circle",
                                 color="#4cc9f0",
+                                # The CAM overlay streams in later under its own spinner
+                                target_components={"results-container": "children"},
                                 children=html.Div(id="results-container", children=_empty_state()),
                             ),
                         ]),
@@ -867,34 +356,112 @@ app.layout = html.Div(
 #  Callbacks
 # ─────────────────────────────────────────────────────────────
 
-@app.callback(
+app.clientside_callback(
+    """
+    function(filename) { return filename ? "✓  " + filename : ""; }
+    """,
     Output("upload-status", "children"),
     Input("upload-image", "filename"),
 )
-def cb_upload_status(filename):
-    return f"✓  {filename}" if filename else ""
+
+
+# Ship the picked file to /upload as binary multipart instead of sending its
+# base64 data URL through the callback JSON; only the returned id is stored.
+# The previous id is dropped (and Run disabled) the moment a new file is
+# picked, so Run can never analyze the old image behind the new preview.
+app.clientside_callback(
+    """
+    function(contents, filename) {
+        var dc = window.dash_clientside;
+        if (!contents) { return [dc.no_update, dc.no_update]; }
+        dc.set_props("upload-id", {data: null});
+        dc.set_props("submit-button", {disabled: true});
+        dc.set_props("upload-status", {className: "upload-status"});
+        return fetch(contents)
+            .then(function(res) { return res.blob(); })
+            .then(function(blob) {
+                var form = new FormData();
+                form.append("image", blob, filename);
+                return fetch("/upload", {method: "POST", body: form});
+            })
+            .then(function(res) {
+                if (res.status === 413) { throw new Error("File is larger than 10 MB."); }
+                if (!res.ok) { throw new Error("Only PNG or JPEG images are accepted."); }
+                return res.json();
+            })
+            .then(function(body) { return [body.id, false]; })
+            .catch(function(err) {
+                dc.set_props("upload-status", {
+                    children: "⚠  Upload failed: " + err.message,
+                    className: "upload-status error",
+                });
+                return [null, true];
+            });
+    }
+    """,
+    Output("upload-id", "data"),
+    Output("submit-button", "disabled"),
+    Input("upload-image", "contents"),
+    State("upload-image", "filename"),
+)
+
+
+def _cache_key(kind, upload_id, age, sex, loc):
+    # Normalize the metadata the same way process_metadata does, so e.g. an
+    # age of 45 vs 45.0 still hits the same entry.
+    return f"{kind}:{upload_id}:{float(age)}:{str(sex).lower()}:{str(loc).lower()}"
+
+
+def cached_predictions(upload_id, raw, age, sex, loc):
+    """run_predictions memoized on the upload's SHA-256 and the patient metadata."""
+    key = _cache_key("infer", upload_id, age, sex, loc)
+    results = cache.get(key)
+    if results is None:
+        results = run_predictions(decode_image(raw), age, sex, loc)
+        cache.set(key, results)
+    return results
+
+
+def cached_gradcam(upload_id, raw, age, sex, loc, target_class):
+    """run_gradcam memoized like cached_predictions, plus the target class."""
+    key = f"{_cache_key('cam', upload_id, age, sex, loc)}:{target_class}"
+    cam_base64 = cache.get(key)
+    if cam_base64 is None:
+        # Eigen-CAM's map comes out of the TTA forward; reuse it when cached.
+        results = cache.get(_cache_key("infer", upload_id, age, sex, loc))
+        cam = results.get("cam") if results else None
+        cam_base64 = run_gradcam(decode_image(raw), age, sex, loc, target_class, cam=cam)
+        cache.set(key, cam_base64)
+    return cam_base64
 
 
 @app.callback(
     Output("results-container", "children"),
+    Output("gradcam-request", "data"),
     Input("submit-button", "n_clicks"),
-    State("upload-image", "contents"),
+    State("upload-id", "data"),
     State("input-age", "value"),
     State("input-sex", "value"),
     State("input-loc", "value"),
     prevent_initial_call=True,
+    background=background_callback_manager is not None,
+    running=[(Output("submit-button", "disabled"), True, False)] if background_callback_manager else None,
 )
-def cb_run_inference(n_clicks, image_contents, age, sex, loc):
-    if image_contents is None:
+def cb_run_inference(n_clicks, upload_id, age, sex, loc):
+    # Plotly's figure classes are only needed here; importing lazily keeps
+    # worker start-up (and health checks) from paying for them.
+    import plotly.graph_objects as go
+
+    upload = cache.get(f"upload:{upload_id}") if upload_id else None
+    if upload is None:
         return html.Div(className="unc-bar", children=[
             html.Span("⚠", className="unc-icon"),
             html.Span("No image uploaded. Please select a dermoscopic image before running analysis."),
-        ])
+        ]), dash.no_update
 
     try:
-        _, content_string = image_contents.split(",")
-        image_bytes = io.BytesIO(base64.b64decode(content_string))
-        results = run_inference(image_bytes, age, sex, loc)
+        results = cached_predictions(upload_id, upload[1], age, sex, loc)
+        del upload  # drop the raw upload bytes before building the response
 
         top     = results["top_prediction"]
         conf    = results["top_confidence"]
@@ -902,27 +469,30 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
         is_unc  = results["is_uncertain"]
         classes = results["classes"]
         probs   = results["probabilities"]
+        # Confident cases skip the CAM forward (and backward) entirely
+        show_cam = margin < GRADCAM_THRESHOLD
 
         meta  = get_meta(top)
         desc  = get_desc(top)
-        risk  = meta["risk"]
-        color = meta["color"]
-        glow  = meta["glow"]
+        risk  = meta.risk
+        color = meta.color
+        glow  = meta.glow
         rs    = get_risk_style(risk)
 
         # ── Sorted pairs ──────────────────────────────────────
-        pairs = sorted(zip(classes, probs), key=lambda x: x[1], reverse=True)
+        order, entropy = summarize_probs(probs)
+        pairs = [(classes[i], probs[i]) for i in order]
 
         prob_items = [
             html.Div(className="prob-item", children=[
                 html.Div(className="prob-dot",
-                        style={"background": get_meta(c)["color"],
-                                "boxShadow": f"0 0 6px {get_meta(c)['glow']}"}),
+                        style={"background": get_meta(c).color,
+                                "boxShadow": f"0 0 6px {get_meta(c).glow}"}),
                 html.Span(c, className="prob-label"),
                 html.Div(className="prob-track", children=[
                     html.Div(className="prob-fill", style={
-                        "width": f"{p * 100:.1f}%",
-                        "background": get_meta(c)["color"],
+                        "transform": f"scaleX({p:.3f})",
+                        "background": get_meta(c).color,
                     }),
                 ]),
                 html.Span(f"{p * 100:.1f}%", className="prob-pct"),
@@ -930,37 +500,27 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
             for c, p in pairs
 ]
 
-        # ── Horizontal bar chart ───────────────────────────────
-        b_colors = [get_meta(c)["color"] for c in classes]
-        bar_fig = go.Figure(go.Bar(
-            x=probs, y=classes, orientation="h",
-            marker=dict(color=b_colors, opacity=0.78, line=dict(width=0)),
-            text=[f"{p * 100:.1f}%" for p in probs],
-            textposition="outside",
-            textfont=dict(size=9, color="#4a6080", family="JetBrains Mono"),
-            hovertemplate="<b>%{y}</b><br>%{x:.2%}<extra></extra>",
-        ))
-        bar_fig.update_layout(
-            paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
-            xaxis=dict(range=[0, 1.14], tickformat=".0%", showgrid=True,
-                       gridcolor="rgba(255,255,255,0.04)", zeroline=False,
-                       tickfont=dict(size=8, color="#4a6080", family="JetBrains Mono"),
-                       showline=False, tickcolor="rgba(0,0,0,0)"),
-            yaxis=dict(categoryorder="total ascending",
-                       tickfont=dict(size=8, color="#6a8aaa"), showgrid=False,
-                       tickcolor="rgba(0,0,0,0)"),
-            margin=dict(l=0, r=10, t=6, b=6),
-            height=220, showlegend=False,
-            font=dict(family="Inter"),
-        )
+        # Compact top-3 ranking; the full list lives in the breakdown box
+        top_items = [
+            html.Div(className="prob-item", children=[
+                html.Span(f"#{rank}", className="rank-num"),
+                html.Div(className="prob-dot",
+                        style={"background": get_meta(c).color,
+                                "boxShadow": f"0 0 6px {get_meta(c).glow}"}),
+                html.Span(c, className="prob-label"),
+                html.Span(f"{p * 100:.1f}%", className="prob-pct",
+                          style={"color": get_meta(c).color}),
+            ])
+            for rank, (c, p) in enumerate(pairs[:3], start=1)
+        ]
 
         # ── Confidence donut ───────────────────────────────────
         top3   = [p for _, p in pairs[:3]]
         rest   = max(0.0, 1.0 - sum(top3))
         d_clrs = [
-            get_meta(pairs[0][0])["color"],
-            get_meta(pairs[1][0])["color"],
-            get_meta(pairs[2][0])["color"],
+            get_meta(pairs[0][0]).color,
+            get_meta(pairs[1][0]).color,
+            get_meta(pairs[2][0]).color,
             "rgba(255,255,255,0.04)",
         ]
         donut_fig = go.Figure(go.Pie(
@@ -970,19 +530,13 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
             marker=dict(colors=d_clrs, line=dict(color="rgba(5,10,20,1)", width=2)),
             textinfo="none",
             hovertemplate="<b>%{label}</b><br>%{value:.2%}<extra></extra>",
-        ))
-        donut_fig.add_annotation(
+        ), layout={**DONUT_LAYOUT, "annotations": [dict(
             text=f"<b>{conf * 100:.0f}%</b><br>"
                  f"<span style='font-size:8px;color:#4a6080;font-family:Inter'>TOP-1</span>",
             x=0.5, y=0.5, showarrow=False,
             font=dict(size=16, color=color, family="JetBrains Mono"),
             align="center",
-        )
-        donut_fig.update_layout(
-            paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
-            margin=dict(l=10, r=10, t=10, b=10), height=220,
-            showlegend=False, font=dict(family="Inter"),
-        )
+        )]})
 
         # ── Decision margin gauge ──────────────────────────────
         # FIX: 'transparent' replaced with 'rgba(0,0,0,0)' for all tickcolor fields
@@ -1018,16 +572,9 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                 "text": "Decision<br>Margin",
                 "font": {"size": 9, "color": "#4a6080", "family": "Inter"},
             },
-        ))
-        gauge_fig.update_layout(
-            paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
-            margin=dict(l=10, r=10, t=36, b=6),
-            height=200,
-            font=dict(family="Inter"),
-        )
+        ), layout=GAUGE_LAYOUT)
 
         # ── Entropy ────────────────────────────────────────────
-        entropy  = -sum(p * math.log(p + 1e-9) for p in probs if p > 0)
         max_ent  = math.log(len(probs))
         norm_ent = entropy / max_ent if max_ent > 0 else 0
         ent_pct  = f"{norm_ent * 100:.0f}%"
@@ -1053,8 +600,8 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
             html.Div(
                 className="pred-card",
                 style={
-                    "background": f"linear-gradient(135deg, {rs['bg']}, rgba(8,14,28,0.6))",
-                    "border": f"1px solid {rs['border']}",
+                    "background": f"linear-gradient(135deg, {rs.bg}, rgba(8,14,28,0.6))",
+                    "border": f"1px solid {rs.border}",
                     "--glow-color": glow,
                 },
                 children=[
@@ -1064,9 +611,9 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                         html.P(top, className="pred-name", style={"color": color}),
                         html.P(desc, className="pred-desc"),
                         html.Span(
-                            f"{meta['icon']}  Risk Level: {risk}",
+                            f"{meta.icon}  Risk Level: {risk}",
                             className="risk-tag",
-                            style={"background": rs["bg"], "border": f"1px solid {rs['border']}", "color": rs["color"]},
+                            style={"background": rs.bg, "border": f"1px solid {rs.border}", "color": rs.color},
                         ),
                     ]),
                     html.Div(className="conf-ring", children=[
@@ -1084,7 +631,7 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                             html.Span("Original Upload", className="img-card-lbl"),
                             html.Span("INPUT", className="img-card-badge"),
                         ]),
-                        html.Img(src=image_contents, style={
+                        html.Img(src=f"/upload/{upload_id}", style={
                             "width": "100%", "height": "auto","maxHeight": "340px",
                             "objectFit": "contain","background": "#080e1c", "display": "block","padding": "8px",
                         }),
@@ -1093,13 +640,19 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                 dbc.Col(xs=12, sm=6, children=[
                     html.Div(className="img-card", children=[
                         html.Div(className="img-card-hdr", children=[
-                            html.Span("Grad-CAM Attention", className="img-card-lbl"),
+                            html.Span(f"{CAM_METHOD} Attention", className="img-card-lbl"),
                             html.Span("XAI", className="img-card-badge cam-badge"),
                         ]),
-                        html.Img(src=results["gradcam_base64"], style={
-                            "width": "100%", "height": "auto","maxHeight": "340px",
-                            "objectFit": "contain", "display": "block","background": "#080e1c","padding": "8px",
-                        }),
+                        dcc.Loading(type="circle", color="#4cc9f0", children=
+                            html.Img(id="gradcam-image", style={
+                                "width": "100%", "height": "auto","maxHeight": "340px",
+                                "objectFit": "contain", "display": "block","background": "#080e1c","padding": "8px",
+                            }),
+                        ) if show_cam else html.Div(
+                            f"Not generated for clear-cut predictions "
+                            f"(margin ≥ {GRADCAM_THRESHOLD * 100:.0f}%).",
+                            className="cam-skip",
+                        ),
                     ]),
                 ]),
             ]),
@@ -1108,9 +661,8 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
             dbc.Row(className="g-2 mb-3", children=[
                 dbc.Col(xs=12, md=5, children=[
                     html.Div(className="data-box", children=[
-                        html.P("Class Probabilities", className="sec-lbl"),
-                        dcc.Graph(figure=bar_fig, config={"displayModeBar": False},
-                                  style={"height": "220px"}),
+                        html.P("Top Predictions", className="sec-lbl"),
+                        html.Div(top_items),
                     ]),
                 ]),
                 dbc.Col(xs=12, sm=6, md=4, children=[
@@ -1125,12 +677,10 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                         html.P("Decision Margin", className="sec-lbl"),
                         dcc.Graph(figure=gauge_fig, config={"displayModeBar": False},
                                   style={"height": "200px"}),
-                        html.Div(style={
-                            "display": "flex", "justifyContent": "space-between", "marginTop": "2px",
-                        }, children=[
-                            html.Span("Uncertain", style={"fontSize": "0.6rem", "color": "#ff4d6d", "fontFamily": "JetBrains Mono, monospace"}),
-                            html.Span("15%", style={"fontSize": "0.6rem", "color": "#4a6080", "fontFamily": "JetBrains Mono, monospace"}),
-                            html.Span("Confident", style={"fontSize": "0.6rem", "color": "#00d9a3", "fontFamily": "JetBrains Mono, monospace"}),
+                        html.Div(className="gauge-scale", children=[
+                            html.Span("Uncertain", style={"color": "#ff4d6d"}),
+                            html.Span("15%", style={"color": "#4a6080"}),
+                            html.Span("Confident", style={"color": "#00d9a3"}),
                         ]),
                     ]),
                 ]),
@@ -1190,27 +740,66 @@ def cb_run_inference(n_clicks, image_contents, age, sex, loc):
                     ]),
                 ]),
             ]),
-        ])
-
-    except Exception as exc:
-        return html.Div(
-            style={
-                "background": "rgba(255,77,109,0.06)",
-                "border": "1px solid rgba(255,77,109,0.25)",
-                "borderRadius": "10px", "padding": "16px",
-            },
-            children=[
-                html.P("Analysis Error", style={
-                    "color": "#ff4d6d", "fontWeight": "700",
-                    "fontSize": "0.75rem", "marginBottom": "5px",
-                    "textTransform": "uppercase", "letterSpacing": "0.8px",
-                }),
-                html.P(str(exc), style={
-                    "color": "#4a6080", "fontSize": "0.78rem",
-                    "fontFamily": "JetBrains Mono, monospace",
-                }),
-            ],
-        )
+        ]), {
+            "upload_id": upload_id, "age": age, "sex": sex, "loc": loc,
+            "target": results["top_index"],
+        } if show_cam else dash.no_update
+
+    except ValueError as exc:
+        # Bad input (e.g. an image that fails to decode): show the reason.
+        return _error_card(str(exc)), dash.no_update
+    except Exception:
+        # Anything else is a bug or an infrastructure failure: keep the
+        # traceback in the server log and don't echo internals to the client.
+        server.logger.exception("Analysis failed for upload %s", upload_id)
+        return _error_card("Something went wrong while analyzing this image. Please try again."), dash.no_update
+
+
+def _error_card(message):
+    """The red "Analysis Error" card shown in place of the results."""
+    return html.Div(
+        style={
+            "background": "rgba(255,77,109,0.06)",
+            "border": "1px solid rgba(255,77,109,0.25)",
+            "borderRadius": "10px", "padding": "16px",
+        },
+        children=[
+            html.P("Analysis Error", style={
+                "color": "#ff4d6d", "fontWeight": "700",
+                "fontSize": "0.75rem", "marginBottom": "5px",
+                "textTransform": "uppercase", "letterSpacing": "0.8px",
+            }),
+            html.P(message, style={
+                "color": "#4a6080", "fontSize": "0.78rem",
+                "fontFamily": "JetBrains Mono, monospace",
+            }),
+        ],
+    )
+
+
+# The CAM overlay fills in after the predictions have rendered, so it no
+# longer holds up the rest of the results. Grad-CAM needs its own forward +
+# backward; Eigen-CAM reuses the map captured during the TTA forward.
+@app.callback(
+    Output("gradcam-image", "src"),
+    Input("gradcam-request", "data"),
+    prevent_initial_call=True,
+    background=background_callback_manager is not None,
+)
+def cb_run_gradcam(request):
+    upload = cache.get(f"upload:{request['upload_id']}") if request else None
+    if upload is None:
+        raise dash.exceptions.PreventUpdate
+    return cached_gradcam(
+        request["upload_id"], upload[1],
+        request["age"], request["sex"], request["loc"], request["target"],
+    )
+
+
+# Compile (or load from the on-disk cache) the Numba kernels while the worker
+# boots, so the first "Run Analysis" click doesn't pay for the JIT.
+summarize_probs(np.zeros(len(IDX_TO_CLASS), dtype=np.float64))
+overlay_heatmap(np.zeros((2, 2), dtype=np.float32), np.zeros((2, 2, 3), dtype=np.uint8), JET_LUT)
 
 
 if __name__ == "__main__":
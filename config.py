@@ -15,6 +15,10 @@ LESION_TYPE_DICT = {
 
 IDX_TO_CLASS = {i: name for i, name in enumerate(LESION_TYPE_DICT.values())}
 
+# The CAM overlay is only produced when the top-1/top-2 margin is below this
+# (comfortably above the 0.15 "uncertain" cutoff); clear-cut cases skip it.
+GRADCAM_THRESHOLD = 0.3
+
 # Standard HAM10000 Metadata Columns
 SEX_COLS = ['sex_female', 'sex_male', 'sex_unknown']
 LOC_COLS = [
@@ -1,21 +1,34 @@
+import math
+import threading
+import cv2
 import torch
 import numpy as np
-from PIL import Image
-import io
-import cv2
-import base64
-from config import CONFIG, IDX_TO_CLASS
+import pybase64
+from turbojpeg import TJPF_RGB, TurboJPEG
+from config import CONFIG, GRADCAM_THRESHOLD, IDX_TO_CLASS
 from model import SkinCancerHybrid_Pro
-from utils import get_inference_transforms, process_metadata
+from utils import JET_LUT, get_inference_transforms, overlay_heatmap, process_metadata
 
 torch.set_num_threads(1)
+# libjpeg-turbo's SIMD encoder for the CAM overlay. PyTurboJPEG needs the
+# system libturbojpeg (installed in the Docker image); without it, fall back
+# to OpenCV's bundled JPEG encoder.
+try:
+    jpeg = TurboJPEG()
+except OSError:
+    jpeg = None
 # Silence the PyTorch NNPACK warning for Cloud Run virtual CPUs
 torch.backends.nnpack.enabled = False
+# Keep the fused SDPA kernels available to SkipAttentionFusion and the
+# stream_a TransformerEncoder (batch_first, no mask) on GPU.
+torch.backends.cuda.enable_flash_sdp(True)
+torch.backends.cuda.enable_mem_efficient_sdp(True)
 
 print(f"Loading model on {CONFIG['device']}...")
 model = SkinCancerHybrid_Pro(
     num_classes=CONFIG['num_classes'],
     num_meta_features=CONFIG['num_meta_features'],
+    img_size=CONFIG['img_size'],
 )
 
 # 1. CLOUD TWEAK: Use the live FUSE bucket path
@@ -35,6 +48,103 @@ except Exception as e:
 model.to(CONFIG['device'])
 model.eval()
 
+# NHWC conv weights: cuDNN's tensor-core kernels for the ConvNeXt/EfficientNet
+# backbones run natively in channels_last. Only 4-D tensors are affected.
+MEMORY_FORMAT = (
+    torch.channels_last if CONFIG['device'].type == "cuda" else torch.contiguous_format
+)
+model.to(memory_format=MEMORY_FORMAT)
+
+# Mixed precision for the no-grad TTA path on GPU; Grad-CAM stays FP32.
+# BF16 keeps FP32's exponent range (no overflow in the logits or the
+# transformer's attention scores) and runs at FP16 speed on Ampere and newer;
+# older cards fall back to FP16.
+USE_AMP = CONFIG['device'].type == "cuda"
+AMP_DTYPE = (
+    torch.bfloat16 if USE_AMP and torch.cuda.is_bf16_supported() else torch.float16
+)
+
+class CUDAGraphTTA:
+    """Replays one captured CUDA graph of the fixed-shape TTA forward.
+
+    Views and metadata are copied into static input buffers before each
+    replay, so replays are serialized across request threads.
+    """
+
+    def __init__(self, model, batch=4):
+        self.model = model
+        self._lock = threading.Lock()
+        self.static_img = torch.zeros(
+            batch, 3, CONFIG['img_size'], CONFIG['img_size'], device=CONFIG['device']
+        ).contiguous(memory_format=MEMORY_FORMAT)
+        self.static_meta = torch.zeros(
+            batch, CONFIG['num_meta_features'], device=CONFIG['device']
+        )
+
+        # Same grad mode / autocast context predict_tta uses.
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=AMP_DTYPE):
+            # Warm up on a side stream (compilation, cuDNN autotuning, allocator
+            # pools) so none of it ends up in the captured graph.
+            side = torch.cuda.Stream()
+            side.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(side):
+                for _ in range(3):
+                    model(self.static_img, self.static_meta)
+            torch.cuda.current_stream().wait_stream(side)
+
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph):
+                self.static_out = model(self.static_img, self.static_meta)
+
+    def eval(self):
+        return self
+
+    def __call__(self, views, meta):
+        with self._lock:
+            self.static_img.copy_(views)
+            self.static_meta.copy_(meta)
+            self.graph.replay()
+            return self.static_out.clone()
+
+
+# 3. Compiled graph for the no-grad TTA path (fixed [4, 3, H, W] batch).
+# Grad-CAM keeps the eager module so its hooks and backward pass behave
+# normally. Inductor's CPU backend needs a C++ toolchain, which the slim
+# Cloud Run image doesn't ship, so only compile on CUDA.
+# On CPU the TTA path instead runs an int8 dynamically-quantized copy of the
+# fusion, meta MLP and classifier-head Linear layers. Check its agreement
+# with the FP32 model on real images with quant_parity.py.
+tta_model = model
+if CONFIG['device'].type == "cuda":
+    # Inductor kernels, launched as a single CUDA graph replay per request.
+    # The graph is captured here rather than by mode="reduce-overhead", whose
+    # graphs are tracked per thread and would be re-recorded in every
+    # gunicorn request thread.
+    tta_model = CUDAGraphTTA(torch.compile(model, dynamic=False))
+else:
+    # Weights are prepacked for the active engine at conversion time, so pick
+    # it first: x86 (fbgemm + oneDNN, VNNI where present) or QNNPACK on ARM.
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            break
+    # Quantize Linears by name, leaving stream_a.transformer in FP32: its
+    # encoder layers' eval fast path reads linear1/linear2 .weight/.bias as
+    # tensors, which dynamic quantized Linears expose as methods. (A type-level
+    # {nn.Linear} spec can't exclude it, since the type match wins over a
+    # parent's None.)
+    tta_model = torch.ao.quantization.quantize_dynamic(
+        model,
+        {
+            name: torch.ao.quantization.default_dynamic_qconfig
+            for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear)
+            and not name.startswith("stream_a.transformer.")
+        },
+        dtype=torch.qint8,
+    )
+
 
 class CustomGradCAM:
     """Lightweight Grad-CAM tailored for the hybrid image + metadata model."""
@@ -42,119 +152,253 @@ class CustomGradCAM:
     def __init__(self, model, target_layer):
         self.model = model
         self.target_layer = target_layer
-        self.gradients = None
         self.activations = None
+        # Weighted-sum output, reused across calls (shape is fixed by img_size)
+        self._cam_buf = None
 
-        self.target_layer.register_forward_hook(self._save_activation)
-        self.target_layer.register_full_backward_hook(self._save_gradient)
+        self._hooks = [self.target_layer.register_forward_hook(self._save_activation)]
 
     def _save_activation(self, module, input, output):
         self.activations = output
 
-    def _save_gradient(self, module, grad_input, grad_output):
-        self.gradients = grad_output[0]
+    def remove_hooks(self):
+        for handle in self._hooks:
+            handle.remove()
+        self._hooks.clear()
 
     def generate(self, image_tensor, meta_tensor, target_class):
-        self.model.zero_grad()
+        # Explicit, so callers running under no_grad still get
+        # a graph to differentiate.
+        with torch.enable_grad():
+            logits = self.model(image_tensor, meta_tensor)
+            score  = logits[0, target_class]
+            # Only dScore/dA is needed: stop the backward pass at the target layer
+            # rather than propagating into (and accumulating .grad on) every weight.
+            (gradients,) = torch.autograd.grad(score, self.activations)
+
+        # Reduce and normalize on the model's device; only the final HxW map
+        # is copied back to the host.
+        activations = self.activations.detach()[0]
+        gradients   = gradients[0]
+        weights     = gradients.mean(dim=(1, 2))
+
+        if self._cam_buf is None or self._cam_buf.shape != activations.shape[1:]:
+            self._cam_buf = torch.empty(
+                activations.shape[1:], dtype=activations.dtype, device=activations.device
+            )
+        cam = self._cam_buf
+        torch.matmul(weights, activations.flatten(1), out=cam.view(-1))  # sum_c w[c] * A[c]
+        return _normalize_cam(cam)
 
-        logits = self.model(image_tensor, meta_tensor)
-        score  = logits[0, target_class]
-        score.backward()
 
-        activations = self.activations.detach().cpu().numpy()[0]
-        gradients   = self.gradients.detach().cpu().numpy()[0]
-        weights     = np.mean(gradients, axis=(1, 2))
+class CustomEigenCAM:
+    """Forward-only Eigen-CAM: projects the target layer's activations onto
+    their first principal component, so no backward pass is needed."""
 
-        cam = np.zeros(activations.shape[1:], dtype=np.float32)
-        for i, w in enumerate(weights):
-            cam += w * activations[i]
+    def __init__(self, model, target_layer):
+        self.model = model
+        self.target_layer = target_layer
+        self.activations = None
 
-        cam = np.maximum(cam, 0)  # ReLU
+        self._hooks = [self.target_layer.register_forward_hook(self._save_activation)]
 
-        if np.max(cam) != 0:
-            cam = cam - np.min(cam)
-            cam = cam / np.max(cam)
+    def _save_activation(self, module, input, output):
+        self.activations = output
 
-        return cam
+    def remove_hooks(self):
+        for handle in self._hooks:
+            handle.remove()
+        self._hooks.clear()
 
+    def generate(self, image_tensor, meta_tensor, target_class=None):
+        # Eigen-CAM is class-agnostic; target_class is accepted for parity.
+        with torch.inference_mode():
+            self.model(image_tensor, meta_tensor)
+            return _eigen_cam(self.activations[0])
 
-def predict_tta(model, image_tensor, meta_tensor):
-    """4-view test-time augmentation: original, h-flip, v-flip, 90° rotation."""
-    
-    model.eval() # Double enforcing eval mode
-    
-    img_orig  = image_tensor.unsqueeze(0).to(CONFIG['device'])
-    meta_batch = meta_tensor.unsqueeze(0).to(CONFIG['device'])
-
-    views = [
-        img_orig,
-        torch.flip(img_orig, [3]),
-        torch.flip(img_orig, [2]),
-        torch.rot90(img_orig, 1, [2, 3]),
-    ]
-
-    probs_sum = torch.zeros(1, CONFIG['num_classes']).to(CONFIG['device'])
-    with torch.no_grad():
-        for view in views:
-            probs_sum += torch.nn.functional.softmax(
-                model(view, meta_batch), dim=1
-            )
 
-    return probs_sum / len(views)
+def _eigen_cam(activations):
+    """Eigen-CAM map of one [C, H, W] feature map; returns the HxW map as numpy."""
+    flat = activations.flatten(1)
+    flat = flat - flat.mean(dim=1, keepdim=True)
 
+    u, _, _ = torch.linalg.svd(flat, full_matrices=False)
+    cam = (u[:, 0] @ flat).reshape(activations.shape[1:])
+    # Singular vectors have an arbitrary sign; orient the map positively.
+    cam = cam * torch.sign(cam.sum())
+    return _normalize_cam(cam)
 
-def run_inference(image_bytes, age, sex, localization):
-    """
-    Run full inference pipeline.
-    """
-    image        = Image.open(image_bytes).convert("RGB")
-    image_tensor = get_inference_transforms()(image)
-    meta_tensor  = process_metadata(age, sex, localization)
 
-    # 1. TTA prediction
-    probs          = predict_tta(model, image_tensor, meta_tensor)
-    probs          = probs.squeeze().cpu().numpy()
-    sorted_indices = np.argsort(probs)[::-1]
-    top_1_idx      = sorted_indices[0]
+def _normalize_cam(cam):
+    """ReLU + min/max scaling to [0, 1] on-device; returns the HxW map as numpy."""
+    cam = cam.clamp_min_(0)  # ReLU
 
-    # 2. Grad-CAM
-    target_layer = model.stream_b.backbone[-1]
-    grad_cam     = CustomGradCAM(model, target_layer)
+    lo, hi = torch.aminmax(cam)  # one reduction instead of separate min/max
+    cam = (cam - lo) / (hi - lo).clamp_min(torch.finfo(cam.dtype).tiny)
 
-    img_batch  = image_tensor.unsqueeze(0).to(CONFIG['device'])
-    img_batch.requires_grad_(True)
-    meta_batch = meta_tensor.unsqueeze(0).to(CONFIG['device'])
+    return cam.cpu().numpy()
 
-    cam_heatmap = grad_cam.generate(img_batch, meta_batch, top_1_idx)
 
-    # 3. Overlay heatmap
-    img_arr     = np.array(image.resize((CONFIG['img_size'], CONFIG['img_size'])))
-    cam_resized = cv2.resize(cam_heatmap, (img_arr.shape[1], img_arr.shape[0]))
+# The backward pass dominates Grad-CAM on CPU-only hosts (Cloud Run), so use
+# the forward-only Eigen-CAM there.
+if CONFIG['device'].type == "cuda":
+    CAM_CLASS, CAM_METHOD = CustomGradCAM, "Grad-CAM"
+else:
+    CAM_CLASS, CAM_METHOD = CustomEigenCAM, "Eigen-CAM"
 
-    heatmap_colored = cv2.applyColorMap(
-        np.uint8(255 * cam_resized), cv2.COLORMAP_JET
-    )
-    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+# gunicorn runs several request threads against the one shared model. The TTA
+# forward is stateless and runs concurrently; CAM generation stashes
+# activations on a hook of the shared model, so it is serialized.
+_cam_lock = threading.Lock()
 
-    superimposed = (heatmap_colored * 0.4 + img_arr * 0.6).astype(np.uint8)
+# One CAM instance (and one hook) for the process: building one per request
+# left another forward hook on the target layer every time.
+_cam = CAM_CLASS(model, model.stream_b.backbone[-1])
 
-    # 4. Encode overlay
-    pil_overlay = Image.fromarray(superimposed)
-    buf         = io.BytesIO()
-    pil_overlay.save(buf, format="JPEG")
-    cam_base64  = (
-        "data:image/jpeg;base64,"
-        + base64.b64encode(buf.getvalue()).decode("utf-8")
-    )
+# Eigen-CAM only needs the un-augmented view's activations at the target
+# layer, and view 0 of the TTA batch computes exactly those (the int8 copy
+# only quantizes Linear layers, so the conv backbone is unchanged). Capture
+# them there, per request thread, instead of repeating the forward later.
+_tta_features = threading.local()
+
+if CAM_CLASS is CustomEigenCAM:
+    def _save_tta_activation(module, input, output):
+        _tta_features.activations = output[0]
+
+    tta_model.stream_b.backbone[-1].register_forward_hook(_save_tta_activation)
+
+
+def to_device(tensor):
+    """Host -> device copy. On CUDA it goes through pinned memory and is
+    non-blocking, so the transfer overlaps with the host-side work that
+    follows instead of stalling on it."""
+    if CONFIG['device'].type == "cuda":
+        return tensor.pin_memory().to(CONFIG['device'], non_blocking=True)
+    return tensor.to(CONFIG['device'])
+
+
+def predict_tta(model, image_tensor, meta_tensor):
+    """4-view test-time augmentation: original, h-flip, v-flip, 90° rotation."""
+    
+    model.eval() # Double enforcing eval mode
+    
+    # Autocast (AMP_DTYPE) on GPU; Grad-CAM runs outside this and stays FP32.
+    with torch.inference_mode(), torch.autocast(
+        device_type=CONFIG['device'].type, dtype=AMP_DTYPE, enabled=USE_AMP
+    ):
+        img_orig   = to_device(image_tensor.unsqueeze(0))
+        meta_batch = meta_tensor.unsqueeze(0)  # process_metadata builds it on-device
+
+        # All views go through the model as one batch of 4 (eval-mode BatchNorm
+        # uses running stats, so batching doesn't change the per-view outputs).
+        views = torch.cat([
+            img_orig,
+            torch.flip(img_orig, [3]),
+            torch.flip(img_orig, [2]),
+            torch.rot90(img_orig, 1, [2, 3]),
+        ], dim=0).contiguous(memory_format=MEMORY_FORMAT)
+
+        logits = model(views, meta_batch.expand(views.shape[0], -1))
+
+    # Mean of the per-view softmaxes, computed in log space:
+    # log(mean_v p_v) = logsumexp_v(log p_v) - log(n_views).
+    log_probs = torch.nn.functional.log_softmax(logits.float(), dim=1)
+    return (torch.logsumexp(log_probs, dim=0, keepdim=True) - math.log(views.shape[0])).exp()
+
+
+def run_predictions(image_rgb, age, sex, localization):
+    """
+    TTA prediction on an RGB uint8 image array (no Grad-CAM).
+
+    With Eigen-CAM, "cam" holds the class-agnostic HxW map taken from the TTA
+    forward, to be handed to run_gradcam; with Grad-CAM, or when the margin
+    means no overlay will be drawn (GRADCAM_THRESHOLD), it is None.
+    """
+    image_tensor = get_inference_transforms()(image_rgb)
+    meta_tensor  = process_metadata(age, sex, localization)
+
+    _tta_features.activations = None
+    probs          = predict_tta(tta_model, image_tensor, meta_tensor)
+    probs          = probs.squeeze().cpu().numpy()
+    top2           = np.argpartition(-probs, 1)[:2]
+    top_1_idx, top_2_idx = top2[np.argsort(-probs[top2])]
 
-    margin = float(probs[top_1_idx] - probs[sorted_indices[1]])
+    margin = float(probs[top_1_idx] - probs[top_2_idx])
 
     return {
+        "top_index":      int(top_1_idx),
         "top_prediction": IDX_TO_CLASS[top_1_idx],
         "top_confidence": float(probs[top_1_idx]),
         "margin":         margin,
         "is_uncertain":   bool(margin < 0.15),
         "classes":        list(IDX_TO_CLASS.values()),
-        "probabilities":  [float(probs[i]) for i in range(len(IDX_TO_CLASS))],
-        "gradcam_base64": cam_base64,
-    }
\ No newline at end of file
+        "probabilities":  probs.astype(np.float64),
+        "cam":            _shared_cam(margin < GRADCAM_THRESHOLD),
+    }
+
+
+def _shared_cam(needed):
+    """Eigen-CAM map from the activations the TTA forward just captured, if any."""
+    activations = _tta_features.activations
+    _tta_features.activations = None
+    if activations is None or not needed:
+        return None
+    with torch.inference_mode():
+        return _eigen_cam(activations)
+
+
+def encode_jpeg(image_rgb, quality=80):
+    """RGB uint8 array -> JPEG bytes."""
+    if jpeg is not None:
+        return jpeg.encode(image_rgb, quality=quality, pixel_format=TJPF_RGB)
+    ok, buf = cv2.imencode(
+        ".jpg", cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR),
+        [int(cv2.IMWRITE_JPEG_QUALITY), quality],
+    )
+    if not ok:
+        raise ValueError("JPEG encoding failed.")
+    return buf.tobytes()
+
+
+def run_gradcam(image_rgb, age, sex, localization, target_class, cam=None):
+    """
+    CAM overlay (see CAM_METHOD) for `target_class`, returned as a JPEG data URL.
+    A precomputed HxW `cam` (run_predictions' "cam") skips the CAM forward.
+    """
+    # 1. Grad-CAM / Eigen-CAM
+    if cam is None:
+        image_tensor = get_inference_transforms()(image_rgb)
+        meta_tensor  = process_metadata(age, sex, localization)
+
+        img_batch  = to_device(image_tensor.unsqueeze(0)).contiguous(memory_format=MEMORY_FORMAT)
+        meta_batch = meta_tensor.unsqueeze(0)
+
+        with _cam_lock:
+            cam = _cam.generate(img_batch, meta_batch, target_class)
+
+    # 2. Overlay heatmap (upsampled from feature-map resolution inside the kernel).
+    # Deliberately on the host: only the feature-map-sized CAM crosses from the
+    # device, whereas a GPU overlay would upload the image and download a
+    # full-size frame, and the JPEG encoder needs the pixels on the host anyway.
+    superimposed = overlay_heatmap(cam, image_rgb, JET_LUT)
+
+    # 3. Encode overlay
+    jpeg_bytes = encode_jpeg(superimposed)
+    return (
+        "data:image/jpeg;base64,"
+        + pybase64.b64encode(jpeg_bytes).decode("utf-8")
+    )
+
+
+def run_inference(image_rgb, age, sex, localization):
+    """
+    Run full inference pipeline on an RGB uint8 image array.
+    "gradcam_base64" is None when the margin is at least GRADCAM_THRESHOLD.
+    """
+    results = run_predictions(image_rgb, age, sex, localization)
+    results["gradcam_base64"] = None
+    if results["margin"] < GRADCAM_THRESHOLD:
+        results["gradcam_base64"] = run_gradcam(
+            image_rgb, age, sex, localization, results["top_index"], cam=results["cam"]
+        )
+    return results
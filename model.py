@@ -3,8 +3,11 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.models as models
 
+def _refresh_pos_emb_cache(module, incompatible_keys):
+    module.cache_pos_embedding()
+
 class ConvNextTransformerStream(nn.Module):
-    def __init__(self, transformer_dim=512, num_heads=8):
+    def __init__(self, transformer_dim=512, num_heads=8, img_size=None):
         super().__init__()
         weights = models.ConvNeXt_Tiny_Weights.DEFAULT
         convnext = models.convnext_tiny(weights=None)
@@ -15,16 +18,35 @@ class ConvNextTransformerStream(nn.Module):
         self.transformer = nn.TransformerEncoder(encoder_layer, num_layers=4)
         self.pool = nn.AdaptiveAvgPool1d(1)
 
+        # The ConvNeXt features are stride 32, so a fixed img_size means a fixed
+        # token count. Keep pos_embedding resized to it for eval-mode forwards,
+        # refreshed whenever weights are loaded.
+        self.num_tokens = (img_size // 32) ** 2 if img_size else None
+        self.register_buffer("pos_emb_cached", None, persistent=False)
+        self.register_load_state_dict_post_hook(_refresh_pos_emb_cache)
+        self.cache_pos_embedding()
+
+    @torch.no_grad()
+    def cache_pos_embedding(self):
+        if self.num_tokens is not None and self.num_tokens != self.pos_embedding.shape[1]:
+            self.pos_emb_cached = self._interpolate_pos_embedding(self.num_tokens)
+
+    def _interpolate_pos_embedding(self, num_tokens):
+        return F.interpolate(self.pos_embedding.transpose(1,2), size=num_tokens, mode='linear').transpose(1,2)
+
     def forward(self, x):
         features = self.backbone(x)
         features = self.projection(features)
         b, c, h, w = features.shape
         tokens = features.flatten(2).transpose(1, 2)
         
-        if tokens.shape[1] != self.pos_embedding.shape[1]:
-            pos_emb = F.interpolate(self.pos_embedding.transpose(1,2), size=tokens.shape[1], mode='linear').transpose(1,2)
-        else:
+        if tokens.shape[1] == self.pos_embedding.shape[1]:
             pos_emb = self.pos_embedding
+        elif (not self.training and self.pos_emb_cached is not None
+              and tokens.shape[1] == self.pos_emb_cached.shape[1]):
+            pos_emb = self.pos_emb_cached
+        else:
+            pos_emb = self._interpolate_pos_embedding(tokens.shape[1])
             
         tokens = tokens + pos_emb
         trans_out = self.transformer(tokens)
@@ -48,29 +70,37 @@ class SkipAttentionFusion(nn.Module):
         super().__init__()
         self.num_heads = num_heads
         self.dim_head = dim_q // num_heads
-        self.scale = self.dim_head ** -0.5
         self.to_q = nn.Linear(dim_q, dim_q, bias=False)
-        self.to_k = nn.Linear(dim_kv, dim_q, bias=False)
-        self.to_v = nn.Linear(dim_kv, dim_q, bias=False)
+        # K and V share their input: one GEMM, split afterwards
+        self.to_kv = nn.Linear(dim_kv, 2 * dim_q, bias=False)
         self.proj = nn.Linear(dim_q, dim_q)
         self.norm = nn.LayerNorm(dim_q)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints saved before the fusion have separate to_k / to_v weights
+        k_key, v_key = prefix + "to_k.weight", prefix + "to_v.weight"
+        if k_key in state_dict and v_key in state_dict:
+            state_dict[prefix + "to_kv.weight"] = torch.cat(
+                [state_dict.pop(k_key), state_dict.pop(v_key)], dim=0
+            )
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
         
     def forward(self, x_q, x_kv):
         B, _ = x_q.shape
         q = self.to_q(x_q).reshape(B, 1, self.num_heads, self.dim_head).permute(0, 2, 1, 3)
-        k = self.to_k(x_kv).reshape(B, 1, self.num_heads, self.dim_head).permute(0, 2, 1, 3)
-        v = self.to_v(x_kv).reshape(B, 1, self.num_heads, self.dim_head).permute(0, 2, 1, 3)
-        dots = (q @ k.transpose(-2, -1)) * self.scale
-        attn = dots.softmax(dim=-1)
-        out = attn @ v
+        k, v = self.to_kv(x_kv).chunk(2, dim=-1)
+        k = k.reshape(B, 1, self.num_heads, self.dim_head).permute(0, 2, 1, 3)
+        v = v.reshape(B, 1, self.num_heads, self.dim_head).permute(0, 2, 1, 3)
+        # Fused attention kernel; applies the default dim_head ** -0.5 scaling
+        out = F.scaled_dot_product_attention(q, k, v)
         out = out.permute(0, 2, 1, 3).reshape(B, -1)
         out = self.proj(out)
         return self.norm(x_q + out)
 
 class SkinCancerHybrid_Pro(nn.Module):
-    def __init__(self, num_classes=7, num_meta_features=19):
+    def __init__(self, num_classes=7, num_meta_features=19, img_size=None):
         super().__init__()
-        self.stream_a = ConvNextTransformerStream(transformer_dim=512)
+        self.stream_a = ConvNextTransformerStream(transformer_dim=512, img_size=img_size)
         self.stream_b = EfficientNetStream() 
         self.skip_attn = SkipAttentionFusion(dim_q=512, dim_kv=1280)
         
@@ -0,0 +1,42 @@
+"""Compares the int8 CPU TTA model against the FP32 model on sample images.
+
+Usage: python quant_parity.py IMAGE [IMAGE ...]
+
+Prints the top-1 class of both models and the max |delta prob| per image, and
+exits non-zero if any top-1 differs or a delta exceeds MAX_PROB_DELTA.
+"""
+import sys
+
+from config import IDX_TO_CLASS
+from inference import model, predict_tta, tta_model
+from utils import decode_image, get_inference_transforms, process_metadata
+
+MAX_PROB_DELTA = 0.02
+
+def check_parity(paths, age=45, sex="male", localization="back"):
+    if tta_model is model:
+        print("TTA model is not quantized on this device; nothing to compare.")
+        return True
+
+    meta_tensor = process_metadata(age, sex, localization)
+    ok = True
+    for path in paths:
+        with open(path, "rb") as f:
+            image_tensor = get_inference_transforms()(decode_image(f.read()))
+
+        ref = predict_tta(model, image_tensor, meta_tensor)[0]
+        quant = predict_tta(tta_model, image_tensor, meta_tensor)[0]
+        ref_top, quant_top = int(ref.argmax()), int(quant.argmax())
+        delta = float((ref - quant).abs().max())
+
+        passed = ref_top == quant_top and delta <= MAX_PROB_DELTA
+        ok = ok and passed
+        print(f"{'OK  ' if passed else 'FAIL'} {path}: "
+              f"fp32={IDX_TO_CLASS[ref_top]} int8={IDX_TO_CLASS[quant_top]} "
+              f"max|dprob|={delta:.4f}")
+    return ok
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    sys.exit(0 if check_parity(sys.argv[1:]) else 1)
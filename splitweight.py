@@ -1,20 +1,43 @@
 import os
 
+def copy_range(src, dst, count):
+    """Copies `count` bytes from src's current offset to dst, kernel-side where possible."""
+    start = src.tell()
+    sent = 0
+    try:
+        # Linux can sendfile between regular files: no Python-side buffers.
+        while sent < count:
+            n = os.sendfile(dst.fileno(), src.fileno(), start + sent, count - sent)
+            if n == 0:
+                break
+            sent += n
+    except (AttributeError, OSError):
+        # No sendfile (Windows), or macOS where the target must be a socket.
+        if sent:
+            raise
+        while sent < count:
+            buf = src.read(min(count - sent, 16 << 20))
+            if not buf:
+                break
+            dst.write(buf)
+            sent += len(buf)
+    src.seek(start + sent)
+    return sent
+
 def split_file():
     filepath = "weights/best_model.pth"
     chunk_size = 45 * 1024 * 1024 # 45 MB chunks
-    
+
     print(f"Splitting {filepath}...")
+    total = os.path.getsize(filepath)
     with open(filepath, 'rb') as f:
-        chunk = f.read(chunk_size)
         i = 0
-        while chunk:
+        while f.tell() < total:
             part_name = f"{filepath}.part{i}"
             with open(part_name, 'wb') as chunk_file:
-                chunk_file.write(chunk)
+                copy_range(f, chunk_file, min(chunk_size, total - f.tell()))
             print(f"Created {part_name}")
             i += 1
-            chunk = f.read(chunk_size)
     print("Done! You can now delete the python script.")
 
-split_file()
\ No newline at end of file
+split_file()
@@ -1,33 +1,121 @@
+import math
+import cv2
 import torch
 import numpy as np
+from numba import njit, prange
 import torchvision.transforms as transforms
 from config import CONFIG, SEX_COLS, LOC_COLS
 
+# OpenCV's JET colormap as a (256, 3) RGB lookup table
+JET_LUT = np.ascontiguousarray(
+    cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET)[:, 0, ::-1]
+)
+
+# Position of each one-hot column in the metadata vector (index 0 is age)
+_SEX_IDX = {col: 1 + i for i, col in enumerate(SEX_COLS)}
+_LOC_IDX = {col: 1 + len(SEX_COLS) + i for i, col in enumerate(LOC_COLS)}
+
 def process_metadata(age, sex, localization):
-        """Accurately maps inputs to the 19-dim vector expected by the model."""
-        meta_vector = np.zeros(CONFIG['num_meta_features'], dtype=np.float32)
+        """Accurately maps inputs to the 19-dim vector expected by the model,
+        returned as a float32 tensor already on CONFIG['device']."""
+        meta_vector = [0.0] * CONFIG['num_meta_features']
         
         # Age Scaling (mean and std from HAM10000 dataset)
         mean_age, std_age = 51.86, 16.96 
         meta_vector[0] = (age - mean_age) / std_age
         
         # Sex One-Hot
-        sex_col = f"sex_{sex.lower()}"
-        if sex_col in SEX_COLS:
-            idx = 1 + SEX_COLS.index(sex_col)
+        idx = _SEX_IDX.get(f"sex_{sex.lower()}")
+        if idx is not None:
             meta_vector[idx] = 1.0
             
         # Localization One-Hot
-        loc_col = f"localization_{localization.lower()}"
-        if loc_col in LOC_COLS:
-            idx = 1 + len(SEX_COLS) + LOC_COLS.index(loc_col)
+        idx = _LOC_IDX.get(f"localization_{localization.lower()}")
+        if idx is not None:
             meta_vector[idx] = 1.0
             
-        return torch.tensor(meta_vector, dtype=torch.float32)
+        # Filled in Python, then a single host -> device copy
+        return torch.tensor(meta_vector, dtype=torch.float32, device=CONFIG['device'])
+
+def decode_image(raw):
+        """Decodes uploaded image bytes into an RGB uint8 array at model input size."""
+        buf = np.frombuffer(raw, dtype=np.uint8)
+        # Ignore EXIF orientation to match what PIL.Image.open used to return.
+        image = cv2.imdecode(buf, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            raise ValueError("Unsupported or corrupted image file.")
+
+        # Downscale phone-sized photos once, up front, so nothing downstream
+        # touches the full-resolution frame.
+        size = (CONFIG['img_size'], CONFIG['img_size'])
+        if image.shape[1::-1] != size:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+# Takes decode_image's output: an RGB uint8 array already at img_size, so the
+# one resize happens there and the same array doubles as the overlay canvas.
+# Built once and shared: the transforms hold no per-call state.
+_INFERENCE_TRANSFORM = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
 
 def get_inference_transforms():
-        return transforms.Compose([
-            transforms.Resize((CONFIG['img_size'], CONFIG['img_size'])),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
\ No newline at end of file
+        return _INFERENCE_TRANSFORM
+
+@njit(cache=True, fastmath=True)
+def summarize_probs(probs):
+        """Returns (class indices by descending probability, entropy) in one fused pass."""
+        n = probs.shape[0]
+        order = np.empty(n, dtype=np.int64)
+        entropy = 0.0
+        for i in range(n):
+            p = probs[i]
+            if p > 0:
+                entropy -= p * math.log(p + 1e-9)
+            # Stable insertion sort, descending
+            j = i
+            while j > 0 and probs[order[j - 1]] < p:
+                order[j] = order[j - 1]
+                j -= 1
+            order[j] = i
+        return order, entropy
+
+@njit(parallel=True, cache=True)
+def overlay_heatmap(cam, image, lut):
+        """Upsamples a [0, 1] CAM to the image size, colour-maps it through `lut` and
+        blends it 40/60 over `image`, all in one pass over the output pixels."""
+        ch, cw = cam.shape
+        h, w = image.shape[0], image.shape[1]
+
+        # Bilinear sampling positions (half-pixel centres, edge-clamped, as in cv2.resize)
+        x0s = np.empty(w, dtype=np.int64)
+        x1s = np.empty(w, dtype=np.int64)
+        wxs = np.empty(w, dtype=np.float64)
+        for x in range(w):
+            fx = min(max((x + 0.5) * cw / w - 0.5, 0.0), cw - 1.0)
+            x0s[x] = int(fx)
+            x1s[x] = min(x0s[x] + 1, cw - 1)
+            wxs[x] = fx - x0s[x]
+
+        # The heatmap's 40% share only depends on the colour index: scale the
+        # 256-entry LUT once instead of every output pixel.
+        heat = np.empty((256, 3), dtype=np.float64)
+        for c in range(256):
+            for k in range(3):
+                heat[c, k] = lut[c, k] * 0.4
+
+        out = np.empty((h, w, 3), dtype=np.uint8)
+        for y in prange(h):
+            fy = min(max((y + 0.5) * ch / h - 0.5, 0.0), ch - 1.0)
+            y0 = int(fy)
+            y1 = min(y0 + 1, ch - 1)
+            wy = fy - y0
+            for x in range(w):
+                x0, x1, wx = x0s[x], x1s[x], wxs[x]
+                v = ((cam[y0, x0] * (1.0 - wx) + cam[y0, x1] * wx) * (1.0 - wy)
+                     + (cam[y1, x0] * (1.0 - wx) + cam[y1, x1] * wx) * wy)
+                c = min(int(255.0 * v), 255)
+                for k in range(3):
+                    out[y, x, k] = int(heat[c, k] + image[y, x, k] * 0.6)
+        return out